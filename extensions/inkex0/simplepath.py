@@ -21,6 +21,11 @@ Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 """
 import re, math
 
+# optional delimiters, followed by a command or a parameter
+_token = re.compile(
+    r'[ \t\r\n,]*(?:([MLHVCSQTAZmlhvcsqtaz])|'
+    r'((?:[-+]?[0-9]+(?:\.[0-9]*)?|[-+]?\.[0-9]+)(?:[eE][-+]?[0-9]+)?))?')
+
 def lexPath(d):
     """
     returns and iterator that breaks path data 
@@ -28,27 +33,20 @@ def lexPath(d):
     """
     offset = 0
     length = len(d)
-    delim = re.compile(r'[ \t\r\n,]+')
-    command = re.compile(r'[MLHVCSQTAZmlhvcsqtaz]')
-    parameter = re.compile(r'(([-+]?[0-9]+(\.[0-9]*)?|[-+]?\.[0-9]+)([eE][-+]?[0-9]+)?)')
+    match = _token.match
     while 1:
-        m = delim.match(d, offset)
-        if m:
-            offset = m.end()
-        if offset >= length:
+        m = match(d, offset)
+        offset = m.end()
+        command, parameter = m.groups()
+        if command:
+            yield [command, True]
+        elif parameter:
+            yield [parameter, False]
+        elif offset >= length:
             break
-        m = command.match(d, offset)
-        if m:
-            yield [d[offset:m.end()], True]
-            offset = m.end()
-            continue
-        m = parameter.match(d, offset)
-        if m:
-            yield [d[offset:m.end()], False]
-            offset = m.end()
-            continue
-        #TODO: create new exception
-        raise Exception('Invalid path data!')
+        else:
+            #TODO: create new exception
+            raise Exception('Invalid path data!')
 '''
 pathdefs = {commandfamily:
     [
@@ -107,7 +105,11 @@ def parsePath(d):
                     command = pathdefs[lastCommand.upper()][0].lower()
             else:
                 raise Exception('Invalid path, no initial command.')    
-        numParams = pathdefs[command.upper()][1]
+        #segment is now absolute so
+        outputCommand = command.upper()
+        defs = pathdefs[outputCommand]
+        relative = command.islower()
+        numParams = defs[1]
         while numParams > 0:
             if needParam:
                 try: 
@@ -116,18 +118,16 @@ def parsePath(d):
                         raise Exception('Invalid number of parameters')
                 except StopIteration:
                     raise Exception('Unexpected end of path')
-            cast = pathdefs[command.upper()][2][-numParams]
+            cast = defs[2][-numParams]
             param = cast(token)
-            if command.islower():
-                if pathdefs[command.upper()][3][-numParams]=='x':
+            if relative:
+                if defs[3][-numParams]=='x':
                     param += pen[0]
-                elif pathdefs[command.upper()][3][-numParams]=='y':
+                elif defs[3][-numParams]=='y':
                     param += pen[1]
             params.append(param)
             needParam = True
             numParams -= 1
-        #segment is now absolute so
-        outputCommand = command.upper()
     
         #Flesh out shortcut notation    
         if outputCommand in ('H','V'):
@@ -6,6 +6,7 @@ Distributed under the terms of the GNU General Public License v2 or later
 
 import th2ex
 from th2ex import (
+    OptionsDict,
     ParsedPath,
     StyleDict,
     parse_scrap_scale_m_per_dots,
@@ -17,8 +18,6 @@ from th2ex import (
     therion_xvi_dx,
     xlink_href,
     xml_space,
-    xpath_attrs,
-    xpath_elems,
     inkscape_groupmode,
     inkscape_label,
     inkscape_original_d,
@@ -29,7 +28,6 @@ from th2ex import (
     parse_options,
     format_options,
     set_props,
-    get_props,
     align_shortcuts,
     align2anchor_default_in,
     align2anchor,
@@ -40,6 +38,7 @@ from th2ex import (
     get_template_svg_path,
 )
 
+import itertools
 import optparse
 import sys
 import os
@@ -48,11 +47,13 @@ from typing import (
     Dict,
     Iterable,
     List,
+    Optional,
     Sequence,
     Tuple,
     Union,
 )
 
+import inkex
 from lxml import etree
 
 EtreeElement = etree._Element
@@ -105,6 +106,16 @@ default_line_opts = {
     'section': {'direction': 'begin'},
 }
 
+_XP_LAYER_SCAN = etree.XPath('svg:g[@id="layer-scan"]', namespaces=inkex.NSS)
+_XP_LAYER_LEGEND = etree.XPath('svg:g[@id="layer-legend"]', namespaces=inkex.NSS)
+_XP_LAYER_SCRAP0 = etree.XPath('svg:g[@id="layer-scrap0"]', namespaces=inkex.NSS)
+_XP_POINT_IDS = etree.XPath('/svg:svg/svg:defs/*[starts-with(@id, "point-")]/@id',
+                           namespaces=inkex.NSS, smart_strings=False)
+_XP_LPE_IDS = etree.XPath('/svg:svg/svg:defs/*[starts-with(@id, "LPE-")]/@id',
+                         namespaces=inkex.NSS, smart_strings=False)
+_XP_GRID = etree.XPath('/svg:svg/sodipodi:namedview/inkscape:grid', namespaces=inkex.NSS)
+_XP_OTHER_LAYERS = etree.XPath('/svg:svg/g[not(@therion:role="none")]', namespaces=inkex.NSS)
+
 # some prefs
 
 class InkOption(optparse.Option):
@@ -141,14 +152,18 @@ class this:
     document: etree._ElementTree
     root: EtreeElement
     layer_stack: List[EtreeElement]
+    layer_scan: EtreeElement
+    layer_legend: EtreeElement
+    layer_scrap0: EtreeElement
 
     line_nr = 0
-    id_count = 0
+    id_counter = itertools.count(1)
     textblock_count = 0
 
     single_line_areas: Dict[str, Tuple[EtreeElement, Sequence[str]]] = {}
-    borders: Dict[str, EtreeElement] = {}  # for areas
+    borders: Dict[str, Tuple[EtreeElement, OptionsDict]] = {}  # for areas
     sublayers: Dict[str, EtreeElement] = {}
+    pending: Dict[EtreeElement, List[EtreeElement]] = {}  # children to prepend
 
     area_adjust = (0., 0., 0., 0.)
 
@@ -177,8 +192,9 @@ class this:
     encoding = 'UTF-8'
     file_stack: List["FileRecord"] = []
 
-    point_symbols: Sequence[str]
-    LPE_symbols: List[str]
+    # ordered sets (dicts with None values) of symbol names
+    point_symbols: Dict[str, None]
+    LPE_symbols: Dict[str, None]
 
     @classmethod
     def getcurrentlayer(this):
@@ -212,7 +228,9 @@ def scale_to_fontsize(scale: str) -> UserUnit:
 
 
 def populate_legend():
-    layer_legend = xpath_elems(this.root, 'svg:g[@id="layer-legend"]')[0]
+    layer_legend = this.layer_legend
+    makeelement = layer_legend.makeelement
+    nodes: List[EtreeElement] = []
 
     # points legend
     spacing = 40
@@ -220,53 +238,62 @@ def populate_legend():
     x = spacing
     y = 0
     for type in this.point_symbols:
-        node = etree.SubElement(layer_legend, 'text')
-        node.set('transform', 'translate(%d,%d)' % (x, -(y + 0.25) * spacing))
+        node = makeelement('text', {'transform': 'translate(%d,%d)' % (x, -(y + 0.25) * spacing)})
         node.text = type
-        node = etree.SubElement(layer_legend, 'use')
+        nodes.append(node)
+        node = makeelement('use')
         set_props(node, 'point', type)
         node.set('transform', 'translate(%d,%d)' % (x, -(y + 1) * spacing))
         node.set(xlink_href, '#point-' + type)
+        nodes.append(node)
         x += spacing
         if x > max_x:
             x = spacing
             y += 2
 
-    node = etree.SubElement(layer_legend, 'rect', {'style': 'fill:none;stroke:black', 'transform': 'scale(1,-1)'})
+    node = makeelement('rect', {'style': 'fill:none;stroke:black', 'transform': 'scale(1,-1)'})
     node.set('height', '%d' % ((2 + y) * spacing))
     if y > 0:
         node.set('width', '%d' % (max_x + spacing))
     else:
         node.set('width', '%d' % (x))
+    nodes.append(node)
 
     # lines legend
     x = spacing
     for type in this.LPE_symbols:
         type_uscore = type
         type = type.replace('_', ':')
-        node = etree.SubElement(layer_legend, 'text')
-        node.set('transform', 'translate(%d,%d)' % (-spacing, x + 0.4 * spacing))
+        node = makeelement('text', {'transform': 'translate(%d,%d)' % (-spacing, x + 0.4 * spacing)})
         node.text = type
-        node = etree.SubElement(layer_legend, 'path')
+        nodes.append(node)
+        node = makeelement('path')
         set_props(node, 'line', type, default_line_opts.get(type, {}))
         node.set(inkscape_original_d, 'M%f,%fh%f' % (-1.5 * spacing, x, spacing))
         node.set(inkscape_path_effect, '#LPE-' + type_uscore)
         node.set('class', 'line ' + type.replace(':', ' '))
+        nodes.append(node)
         x += spacing
     for type in ('arrow', 'map-connection', 'gradient', 'chimney', 'section'):
-        node = etree.SubElement(layer_legend, 'text')
-        node.set('transform', 'translate(%d,%d)' % (-spacing, x + 0.4 * spacing))
+        node = makeelement('text', {'transform': 'translate(%d,%d)' % (-spacing, x + 0.4 * spacing)})
         node.text = type
-        node = etree.SubElement(layer_legend, 'path')
+        nodes.append(node)
+        node = makeelement('path')
         set_props(node, 'line', type, default_line_opts.get(type, {}))
         node.set('d', 'M%f,%fh%f' % (-1.5 * spacing, x, spacing))
         node.set('class', 'line ' + type)
+        nodes.append(node)
         x += spacing
 
-    node = etree.SubElement(layer_legend, 'rect', {'y': '0', 'style': 'fill:none;stroke:black'})
-    node.set('x', '%d' % (-2 * spacing))
-    node.set('height', '%d' % (x))
-    node.set('width', '%d' % (2 * spacing))
+    nodes.append(makeelement('rect', {
+        'y': '0',
+        'style': 'fill:none;stroke:black',
+        'x': '%d' % (-2 * spacing),
+        'height': '%d' % (x),
+        'width': '%d' % (2 * spacing),
+    }))
+
+    layer_legend.extend(nodes)
 
 
 def getlayer(role: str, type: str):
@@ -279,16 +306,89 @@ def getlayer(role: str, type: str):
     return this.sublayers.get(key, this.getcurrentlayer())
 
 
+def prepend_to_layer(layer: EtreeElement, e: EtreeElement):
+    '''
+    Add `e` as the first child of `layer`.
+
+    Inside a scrap, the insertion is deferred to `flush_pending()`, which
+    attaches all collected children with a single operation per layer.
+    '''
+    pending = this.pending.get(layer)
+    if pending is None:
+        layer.insert(0, e)
+    else:
+        pending.append(e)
+
+
+def flush_pending():
+    '''
+    Attach deferred children in reverse parse order (top-most = last parsed).
+    '''
+    for layer, pending in this.pending.items():
+        layer[:0] = pending[::-1]
+    this.pending = {}
+
+
 class FileRecord:
     def __init__(self, patharg: str):
         searchpath: List[str] = [this.file_stack[-1].dirname] if this.file_stack else []
         self.filename: str = find_in_pwd(patharg, searchpath)
         self.dirname: str = os.path.dirname(self.filename)
-        self.f_handle = open(self.filename, 'rb')
-        self.f_enum = enumerate(self.f_handle)
-
-    def __del__(self):
-        self.f_handle.close()
+        with open(self.filename, 'rb') as handle:
+            self.data: bytes = handle.read()
+        self.line_count = self.data.count(b'\n')
+        if not self.data.endswith(b'\n') and self.data:
+            self.line_count += 1
+        self.lines: List[str] = []
+        self.encoding = ''
+        self.line_nr = -1
+        # (byte offset, line number) of the last decoded block
+        self.decode_pos = (0, 0)
+
+    def byte_offset(self, line_nr: int) -> int:
+        """
+        Byte offset of the given line. Walks forward from the last decoded
+        block, which is usually only a few lines back.
+        """
+        pos, n = self.decode_pos
+        while n < line_nr:
+            pos = self.data.index(b'\n', pos) + 1
+            n += 1
+        self.decode_pos = (pos, n)
+        return pos
+
+    def decode_remaining(self):
+        """
+        Decode all unread lines at once with the current encoding. Stops
+        before the first line which fails to decode, it might be readable
+        after an encoding change.
+        """
+        start = self.line_nr + 1
+        data = self.data[self.byte_offset(start):]
+        try:
+            text = data.decode(this.encoding)
+        except UnicodeDecodeError as ex:
+            end = data.rfind(b'\n', 0, ex.start)
+            if end == -1:
+                raise
+            text = data[:end].decode(this.encoding)
+        lines = text.split('\n')
+        if '\r' in text:
+            lines = [line.rstrip('\r') for line in lines]
+        self.lines[start:] = lines
+        self.encoding = this.encoding
+
+    def readline(self) -> Optional[str]:
+        """
+        Get the next line without line ending, or None at end of file.
+        """
+        i = self.line_nr + 1
+        if i == self.line_count:
+            return None
+        if i == len(self.lines) or self.encoding != this.encoding:
+            self.decode_remaining()
+        self.line_nr = i
+        return self.lines[i]
 
 
 def set_m_per_dots(value: float, overwrite: bool = False):
@@ -309,6 +409,13 @@ def floatscale(x: Union[str, Th2Coord]) -> UserUnit:
     return float(x) / th2pref.scale_th2_per_uu
 
 
+def _format_uu(v: float) -> str:
+    """
+    Format a user unit value with 8 decimals and without trailing zeros.
+    """
+    return format(v, '.8f').rstrip('0').rstrip('.')
+
+
 def flipY(a: Iterable[str]) -> List[str]:
     """
     Transform th2 coordinates to SVG user units.
@@ -323,10 +430,25 @@ def flipY(a: Iterable[str]) -> List[str]:
       Transformed coordinate list
     """
     a = list(a)
-    # TODO %f rounds to 6 digits, check if sufficient
-    a[0::2] = ['%.8f' % (floatscale(i)) for i in a[0::2]]
-    a[1::2] = ['%.8f' % (-floatscale(i)) for i in a[1::2]]
-    return a
+    scale = th2pref.scale_th2_per_uu
+    out: List[str] = []
+    append = out.append
+    it = iter(a)
+    for x, y in zip(it, it):
+        append(_format_uu(float(x) / scale))
+        append(_format_uu(-float(y) / scale))
+    if len(a) % 2:
+        # keep a dangling x value, so that add_coords() can report it
+        append(_format_uu(float(a[-1]) / scale))
+    return out
+
+
+def _flip_xy(x: str, y: str) -> Tuple[str, str]:
+    """
+    Like flipY() for a single point.
+    """
+    scale = th2pref.scale_th2_per_uu
+    return _format_uu(float(x) / scale), _format_uu(-float(y) / scale)
 
 
 def formatPath(a: ParsedPath) -> str:
@@ -334,41 +456,48 @@ def formatPath(a: ParsedPath) -> str:
 
     Copied from simplepath
     """
-    return "".join([cmd + " ".join([str(p) for p in params]) for (cmd, params) in a])
+    return "".join([cmd + " ".join(map(str, params)) for (cmd, params) in a])
 
 
 def reverseP(p: ParsedPath) -> ParsedPath:
-    prevcmd = p[-1][0]
-    prevparams = p[-1][1]
+    prevcmd, prevparams = p[-1]
     retval: ParsedPath = [('M', prevparams[-2:])]
-    for cmd, params in reversed(p[:-1]):
-        newparams = []
+    append = retval.append
+    for cmd, params in itertools.islice(reversed(p), 1, None):
         if len(prevparams) == 6:
+            # swap control points
             newparams = [
                 prevparams[2],
                 prevparams[3],
                 prevparams[0],
                 prevparams[1],
+                *params[-2:],
             ]
-        newparams.extend(params[-2:])
-        retval.append((prevcmd, newparams))
-        prevparams = params
-        prevcmd = cmd
+        else:
+            newparams = list(params[-2:])
+        append((prevcmd, newparams))
+        prevcmd, prevparams = cmd, params
     return retval
 
 
 def f_readline() -> str:
-    try:
-        this.line_nr, bline = next(this.file_stack[-1].f_enum)
-    except StopIteration:
-        this.file_stack.pop()
-        this.layer_stack.pop()
-        return f_readline() if this.file_stack else ''
-    bline = bline.rstrip(b'\r\n')
-    line = bline.decode(this.encoding)
-    if line.endswith('\\'):
-        line = line[:-1] + f_readline()
-    return line + '\n'
+    parts: List[str] = []
+    top = this.file_stack[-1]
+    while True:
+        line = top.readline()
+        if line is None:
+            this.file_stack.pop()
+            this.layer_stack.pop()
+            if not this.file_stack:
+                return ''.join(parts)
+            top = this.file_stack[-1]
+            continue
+        this.line_nr = top.line_nr
+        if line.endswith('\\'):
+            parts.append(line[:-1])
+            continue
+        parts.append(line)
+        return ''.join(parts) + '\n'
 
 
 def errormsg(x):
@@ -379,11 +508,8 @@ def errormsg(x):
     print(f'[{prefix}{this.line_nr + 1}] {x}', file=sys.stderr)
 
 
-def parse(a: Sequence[str]):
-    function = parsedict.get(a[0])
-    if function:
-        function(a)
-    elif a[0].startswith('#'):
+def parse_unknown(a: Sequence[str]):
+    if a[0].startswith('#'):
         parse_LINE2COMMENT(a)
     else:
         errormsg('skipped: ' + a[0])
@@ -400,29 +526,123 @@ def parse_INKSCAPE(a: Sequence[str]):
         img.set('height', a[3])
         img.set('transform', a[4])
         img.set(xlink_href, ' '.join(a[5:]))
-        xpath_elems(this.root, 'svg:g[@id="layer-scan"]')[0].append(img)
+        this.layer_scan.append(img)
+
+
+_TCL_ESCAPES = {
+    'a': '\a', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t', 'v': '\v',
+}
+_RE_TCL_BACKSLASH = re.compile(
+    r'\\(?:([0-3][0-7]{0,2}|[4-7][0-7]?)|x([0-9a-fA-F]{1,2})|u([0-9a-fA-F]{1,4})|'
+    r'U([0-9a-fA-F]{1,8})|\n[ \t]*|(.))', re.DOTALL)
+
+
+def _tcl_backslash(s: str, i: int) -> Tuple[str, int]:
+    """
+    Tcl backslash substitution of the sequence at s[i] (a backslash).
+
+    Returns:
+      The substituted text and the index after the sequence
+    """
+    m = _RE_TCL_BACKSLASH.match(s, i)
+    assert m is not None
+    octal, hex2, hex4, hex8, char = m.groups()
+    if octal:
+        return chr(int(octal, 8)), m.end()
+    if hex2 or hex4:
+        return chr(int(hex2 or hex4, 16)), m.end()
+    if hex8:
+        # only as many digits as give a valid code point
+        while int(hex8, 16) > 0x10FFFF:
+            hex8 = hex8[:-1]
+        return chr(int(hex8, 16)), m.start(4) + len(hex8)
+    if char is None:
+        # backslash-newline and the following blanks
+        return ' ', m.end()
+    return _TCL_ESCAPES.get(char, char), m.end()
+
+
+def _tcl_list_split(s: str) -> List[str]:
+    """
+    Split a Tcl list into its elements (like Tcl's "lindex"). Supports
+    {braced} elements (nested, no substitution), "quoted" elements and
+    Tcl's backslash substitutions in unbraced elements.
+    """
+    elems: List[str] = []
+    n = len(s)
+    i = 0
+    while True:
+        while i < n and s[i].isspace():
+            i += 1
+        if i == n:
+            return elems
+        if s[i] == '{':
+            depth = 1
+            start = i = i + 1
+            while depth:
+                if i >= n:
+                    raise ValueError('unmatched open brace in list')
+                if s[i] == '\\':
+                    i += 1
+                elif s[i] == '{':
+                    depth += 1
+                elif s[i] == '}':
+                    depth -= 1
+                i += 1
+            elems.append(s[start:i - 1])
+        else:
+            quoted = s[i] == '"'
+            if quoted:
+                i += 1
+            chars = []
+            while i < n and (s[i] != '"' if quoted else not s[i].isspace()):
+                if s[i] == '\\' and i + 1 < n:
+                    char, i = _tcl_backslash(s, i)
+                    chars.append(char)
+                    continue
+                chars.append(s[i])
+                i += 1
+            if quoted:
+                if i == n:
+                    raise ValueError('unmatched open quote in list')
+                i += 1
+            elems.append(''.join(chars))
+        if i < n and not s[i].isspace():
+            raise ValueError('list element followed by garbage')
+
+
+def _tcl_negate(s: str) -> str:
+    """
+    Equivalent of Tcl's [expr (-1 * s)]
+    """
+    try:
+        return str(-int(s))
+    except ValueError:
+        return repr(-float(s))
+
+
+_RE_XTHERION_IMG = re.compile(
+    r'\{([-.0-9]+) [01] [-.0-9]+\} \{?([-.0-9]+)(?: (?:\{\}|[-.0-9]+)\})? (\S+)')
+_RE_BASENAME = re.compile(r".*[/\\]")
 
 
 def parse_XTHERION(a: Sequence[str]):
     if a[1] == 'xth_me_image_insert':
         href, XVIroot = '', ''
+        me_image_str = ' '.join(a[2:])
         try:
             # xth_me_image_insert {xx yy fname iidx imgx}
             # xx = {xx vsb igamma}
             # yy = {yy XVIroot}
             # XVIroot is the station name which defines (0,0)
-            me_image_str = ' '.join(a[2:])
-            import tkinter
-            tk_instance = tkinter.Tcl().tk.eval
-            tk_instance('set xth_me_image {' + me_image_str + '}')
-            href = tk_instance('lindex $xth_me_image 2')
-            x = tk_instance('lindex $xth_me_image 0 0')
-            y = tk_instance('expr (-1 * [lindex $xth_me_image 1 0])')
-            XVIroot = tk_instance('lindex $xth_me_image 1 1')
-        except BaseException as e:
-            errormsg('tk parsing failed, fallback to regex (%s)' % str(e))
+            xx, yy, href = (_tcl_list_split(me_image_str) + [''] * 3)[:3]
+            x = (_tcl_list_split(xx) + [''])[0]
+            y, XVIroot = (_tcl_list_split(yy) + [''] * 2)[:2]
+            y = _tcl_negate(y)
+        except ValueError as e:
+            errormsg('list parsing failed, fallback to regex (%s)' % str(e))
             # TODO: Warning: poor expression, might fail
-            m = re.match(r'\{([-.0-9]+) [01] [-.0-9]+\} \{?([-.0-9]+)(?: (?:\{\}|[-.0-9]+)\})? (\S+)', ' '.join(a[2:]))
+            m = _RE_XTHERION_IMG.match(me_image_str)
             if m:
                 href = m.group(3)
                 if href[0] == '"':
@@ -445,8 +665,8 @@ def parse_XTHERION(a: Sequence[str]):
                 img.set(therion_type, 'xth_me_image_insert')
                 img.set(therion_options, format_options({'href': href,
                                                          'XVIroot': XVIroot}))
-                img.set(inkscape_label, re.sub(r".*[/\\]", "", href))
-                xpath_elems(this.root, 'svg:g[@id="layer-scan"]')[0].append(img)
+                img.set(inkscape_label, _RE_BASENAME.sub("", href))
+                this.layer_scan.append(img)
 
                 dx = g_xvi.get(therion_xvi_dx)
                 if dx:
@@ -457,12 +677,12 @@ def parse_XTHERION(a: Sequence[str]):
         elif href != '':
             img = etree.Element('image')
             img.set("style", "opacity: 0.5")
-            img.set(inkscape_label, re.sub(r".*[/\\]", "", href))
+            img.set(inkscape_label, _RE_BASENAME.sub("", href))
             img.set(xlink_href, href)
             img.set('x', x)
             img.set('y', y)
             img.set('transform', 'scale(1,-1)')
-            xpath_elems(this.root, 'svg:g[@id="layer-scan"]')[0].append(img)
+            this.layer_scan.append(img)
         else:
             errormsg('skipped: ' + a[1])
 
@@ -472,6 +692,18 @@ def parse_XTHERION(a: Sequence[str]):
         this.root.set(th2ex.therion_area_zoom_to, a[2])
 
 
+# scrap sublayers (key, attributes)
+_SUBLAYERS = tuple(
+    (key, {inkscape_groupmode: 'layer', inkscape_label: label}) for key, label in [
+        ('wall', 'Walls'),
+        ('cont', 'Contours'),
+        ('rock', 'Boulders'),
+        ('stat', 'Stations'),
+        ('misc', 'Misc'),
+        ('labe', 'Labels'),
+    ])
+
+
 def parse_scrap(a: Sequence[str]):
     e = etree.Element('g')
     e.set(inkscape_groupmode, "layer")
@@ -487,17 +719,16 @@ def parse_scrap(a: Sequence[str]):
 
     if th2pref.sublayers:
         this.sublayers = {
-            'wall': etree.SubElement(e, 'g', {inkscape_groupmode: 'layer', inkscape_label: u'Walls'}),
-            'cont': etree.SubElement(e, 'g', {inkscape_groupmode: 'layer', inkscape_label: u'Contours'}),
-            'rock': etree.SubElement(e, 'g', {inkscape_groupmode: 'layer', inkscape_label: u'Boulders'}),
-            'stat': etree.SubElement(e, 'g', {inkscape_groupmode: 'layer', inkscape_label: u'Stations'}),
-            'misc': etree.SubElement(e, 'g', {inkscape_groupmode: 'layer', inkscape_label: u'Misc'}),
-            'labe': etree.SubElement(e, 'g', {inkscape_groupmode: 'layer', inkscape_label: u'Labels'}),
+            key: etree.SubElement(e, 'g', attrib) for key, attrib in _SUBLAYERS
         }
 
     this.getcurrentlayer().append(e)
     this.layer_stack.append(e)
 
+    this.pending = {layer: [] for layer in [e, *this.sublayers.values()]}
+
+    get_function = parsedict.get
+
     while True:
         line = f_readline()
         assert line != ''
@@ -506,8 +737,9 @@ def parse_scrap(a: Sequence[str]):
             continue
         if a[0] == 'endscrap':
             break
-        parse(a)
+        (get_function(a[0]) or parse_unknown)(a)
 
+    flush_pending()
     promote_borders_to_areas()
 
     this.layer_stack.pop()
@@ -521,11 +753,9 @@ def preserve_literal(a: Sequence[str], lines: Sequence[str] = ()):
     set_props(e, 'textblock', '@')
     desc = etree.SubElement(e, 'desc')
     assert a  # seems to be true (subject to change?)
-    chunks = [' '.join(a) + '\n']
-    chunks.extend(lines)
-    desc.text = ''.join(chunks)
+    desc.text = ' '.join(a) + '\n' + ''.join(lines)
     assert desc.text.endswith("\n")
-    this.getcurrentlayer().insert(0, e)
+    prepend_to_layer(this.getcurrentlayer(), e)
     return e
 
 
@@ -537,15 +767,12 @@ def preserve_literal_as_comment(a: Sequence[str], lines: Sequence[str] = ()):
       a: Optional first line as sequence of words
       lines: Lines, including the line feed.
     """
-    chunks = ['#therion\n']
     assert a  # seems to be true (subject to change?)
-    chunks.append(' '.join(a) + '\n')
-    chunks.extend(lines)
-    text = ''.join(chunks)
+    text = '#therion\n' + ' '.join(a) + '\n' + ''.join(lines)
     assert text.endswith("\n")
     e = etree.Comment()
     e.text = text
-    this.getcurrentlayer().insert(0, e)
+    prepend_to_layer(this.getcurrentlayer(), e)
 
 
 def read_block_lines(sentinel: str, *, skip_blank: bool = False) -> List[str]:
@@ -556,7 +783,8 @@ def read_block_lines(sentinel: str, *, skip_blank: bool = False) -> List[str]:
     while True:
         line = f_readline()
         assert line != ''
-        a = line.split()
+        # only the first word is needed
+        a = line.split(None, 1)
         if skip_blank and not a:
             continue
         lines.append(line)
@@ -579,7 +807,8 @@ def parse_area(a_in: Sequence[str]):
     # we can only handle areas with one border line
     line_id = lines[0].strip() if len(lines) == 2 else ""
     if line_id:
-        this.single_line_areas[line_id] = (e, tuple(a_in))
+        # no copy needed, `a_in` is not modified by the caller
+        this.single_line_areas[line_id] = (e, a_in)
 
 
 def promote_border_to_area(a_in: Sequence[str], line_id: str) -> bool:
@@ -588,12 +817,10 @@ def promote_border_to_area(a_in: Sequence[str], line_id: str) -> bool:
     area.
     '''
     assert a_in[0] == 'area'
-    e = this.borders.pop(line_id, None)
-    if e is None:
+    border = this.borders.pop(line_id, None)
+    if border is None:
         return False
-    role, type, options = get_props(e)
-    type, _ = _pop_subtype(type, {})
-    assert (role, type) == ('line', 'border')
+    e, options = border
     options = {f"line-{key}": value for (key, value) in options.items()}
     options.update(parse_options(a_in[2:]))
     type_subtype = a_in[1]
@@ -652,7 +879,7 @@ def preserve_literal_as_textblock(a: Sequence[str], lines: Sequence[str] = ()):
     desc = etree.SubElement(e, 'desc')
     desc.tail = ' '.join(a)
     desc.text = ''.join(lines[:-1])
-    this.getcurrentlayer().insert(0, e)
+    prepend_to_layer(this.getcurrentlayer(), e)
     this.textblock_count += 1
 
 
@@ -758,8 +985,7 @@ def parse_line(a: Sequence[str]):
         errormsg('warning: empty line')
         return
 
-    this.id_count += 1
-    e_id = 'line_%s_%d' % (type, this.id_count)
+    e_id = f'line_{type}_{next(this.id_counter)}'
     is_segmented = any(seg.options for seg in segline.segments)
 
     if not is_segmented:
@@ -781,34 +1007,42 @@ def parse_line(a: Sequence[str]):
 
         e = etree.Element('g')
 
+    LPE_symbols = this.LPE_symbols
+    e_paths: List[EtreeElement] = []
+
     for seg in segline.segments:
         d = seg.get_d()
         subtype = seg.options.get('subtype', subtype)
 
-        e_path = etree.Element('path')
-        e_path.set('class', 'line %s %s' % (type, subtype))
+        attrib = {'class': f'line {type} {subtype}'}
 
-        if type + '_' + subtype in this.LPE_symbols:
-            e_path.set(inkscape_path_effect, '#LPE-%s_%s' % (type, subtype))
-            e_path.set(inkscape_original_d, d)
-        elif type in this.LPE_symbols:
-            e_path.set(inkscape_path_effect, '#LPE-%s' % (type))
-            e_path.set(inkscape_original_d, d)
+        if type + '_' + subtype in LPE_symbols:
+            attrib[inkscape_path_effect] = f'#LPE-{type}_{subtype}'
+            attrib[inkscape_original_d] = d
+        elif type in LPE_symbols:
+            attrib[inkscape_path_effect] = f'#LPE-{type}'
+            attrib[inkscape_original_d] = d
         else:
-            e_path.set('d', d)
+            attrib['d'] = d
             if seg.options.get('altitude') is not None:
-                e_path.set('style', 'marker-start:url(#linept-altitude)')
+                attrib['style'] = 'marker-start:url(#linept-altitude)'
+
+        attrib[sodipodi_nodetypes] = "".join(seg.nodetypes)
 
-        e_path.set(sodipodi_nodetypes, "".join(seg.nodetypes))
+        e_path = etree.Element('path', attrib)
 
         if e is None:
             e = e_path
         else:
-            e.insert(0, e_path)
+            e_paths.append(e_path)
             set_props(e_path, '@', '@', seg.options)
 
     assert e is not None
 
+    if e_paths:
+        # first segment is the top-most child
+        e.extend(reversed(e_paths))
+
     e.set('id', e_id)
 
     if th2pref.textonpath and type == 'label':
@@ -821,14 +1055,14 @@ def parse_line(a: Sequence[str]):
         e_textPath.text = options.pop('text', '')
         if not e_textPath.text:
             errormsg('line label without text')
-        getlayer('line', type).insert(0, e_text)
+        prepend_to_layer(getlayer('line', type), e_text)
 
     # for areas
     if type == 'border' and 'id' in options and not is_segmented:
-        this.borders[options['id']] = e
+        this.borders[options['id']] = (e, options)
 
     set_props(e, 'line', type_subtype, options)
-    getlayer('line', type).insert(0, e)
+    prepend_to_layer(getlayer('line', type), e)
 
 
 _RE_TAG = re.compile(r"<([a-z:]+)>")
@@ -839,10 +1073,11 @@ def text_to_styles(text: str):
     Parse the leading style tags to CSS properties.
     """
     styles: StyleDict = {}
+    if not text.startswith('<'):
+        return styles
     pos = 0
-    while True:
-        m = _RE_TAG.match(text, pos)
-        if m is None:
+    for m in _RE_TAG.finditer(text):
+        if m.start() != pos:
             break
         styles.update(th2ex.tag2style.get(m.group(1), ()))
         pos = m.end()
@@ -879,30 +1114,29 @@ def parse_point(a: Sequence[str]):
                                                                                            textanchor, textanchor, baseline))
         e.set(xml_space, 'preserve')
     elif type in this.point_symbols:
-        e = etree.Element('use')
-        e.set(xlink_href, "#point-" + type)
+        e = etree.Element('use', {xlink_href: "#point-" + type})
         if type == "station" and th2pref.lock_stations:
             e.set(sodipodi_insensitive, "true")
     else:
-        e = etree.Element('circle')
-        e.set('cx', '0')  # https://gitlab.com/inkscape/inbox/-/issues/11365
-        e.set('cy', '0')  # https://gitlab.com/inkscape/inbox/-/issues/11365
-        e.set('r', '2')
         color = point_colors.get(type, "blue")
-        e.set('style', f'stroke:none;fill:{color};fill-opacity:0.8')
+        e = etree.Element('circle', {
+            'cx': '0',  # https://gitlab.com/inkscape/inbox/-/issues/11365
+            'cy': '0',  # https://gitlab.com/inkscape/inbox/-/issues/11365
+            'r': '2',
+            'style': f'stroke:none;fill:{color};fill-opacity:0.8',
+        })
 
     # position and orientation
-    transform = 'translate(%s,%s)' % tuple(flipY(a[1:3]))
+    transform = 'translate(%s,%s)' % _flip_xy(a[1], a[2])
     if 'orientation' in options:
         transform += ' rotate(%s)' % (options['orientation'])
         del options['orientation']
     e.set('transform', transform)
 
-    this.id_count += 1
-    e.set('id', 'point_%s_%d' % (type, this.id_count))
+    e.set('id', f'point_{type}_{next(this.id_counter)}')
 
     set_props(e, 'point', a[3], options)
-    getlayer('point', type).insert(0, e)
+    prepend_to_layer(getlayer('point', type), e)
 
 
 def parse_input(a: Sequence[str]):
@@ -942,21 +1176,26 @@ def main() -> None:
 
     this.root = this.document.getroot()
     this.layer_stack = [this.root]
+    this.layer_scan = _XP_LAYER_SCAN(this.root)[0]
+    this.layer_legend = _XP_LAYER_LEGEND(this.root)[0]
+    this.layer_scrap0 = _XP_LAYER_SCRAP0(this.root)[0]
 
     # save input prefs to file
     th2pref_store_to_xml(this.root)
 
-    ids = xpath_attrs(this.root, '/svg:svg/svg:defs/*[starts-with(@id, "point-")]/@id')
-    this.point_symbols = [id[6:] for id in ids]
+    ids = _XP_POINT_IDS(this.root)
+    this.point_symbols = dict.fromkeys(id[6:] for id in ids)
 
-    ids = xpath_attrs(this.root, '/svg:svg/svg:defs/*[starts-with(@id, "LPE-")]/@id')
-    this.LPE_symbols = [id[4:] for id in ids]
+    ids = _XP_LPE_IDS(this.root)
+    this.LPE_symbols = dict.fromkeys(id[4:] for id in ids)
 
     populate_legend()
 
     # open th2 file
     this.file_stack.append(FileRecord(th2pref.argv[0]))
 
+    get_function = parsedict.get
+
     while True:
         line = f_readline()
         if len(line) == 0:
@@ -967,7 +1206,7 @@ def main() -> None:
         if len(a) == 0:
             continue
 
-        parse(a)
+        (get_function(a[0]) or parse_unknown)(a)
 
     assert not this.file_stack
 
@@ -975,21 +1214,19 @@ def main() -> None:
         this.root.set('width', f"{this.doc_width * this.cm_per_uu}cm")
         this.root.set('height', f"{this.doc_height * this.cm_per_uu}cm")
         this.root.set('viewBox', f"{this.doc_x} {-this.doc_y} {this.doc_width} {this.doc_height}")
-        grid = xpath_elems(this.root, '/svg:svg/sodipodi:namedview/inkscape:grid')[0]
+        grid = _XP_GRID(this.root)[0]
         grid.set("spacingx", f"{1 / this.cm_per_uu}")
         grid.set("spacingy", f"{1 / this.cm_per_uu}")
 
-    e = xpath_elems(this.root, 'svg:g[@id="layer-scan"]')[0]
-    e.set('transform', ' scale(1,-1) scale(%s)' % floatscale(1))
+    this.layer_scan.set('transform', ' scale(1,-1) scale(%s)' % floatscale(1))
 
-    e = xpath_elems(this.root, 'svg:g[@id="layer-legend"]')[0]
-    e.set('transform', f'translate({this.doc_x} {-this.doc_y})')
+    this.layer_legend.set('transform', f'translate({this.doc_x} {-this.doc_y})')
 
     # scrap0:
     # Mostly obsolete, we currently don't populate it.
     # Keep it when opening an empty file.
-    e = xpath_elems(this.root, 'svg:g[@id="layer-scrap0"]')[0]
-    others = xpath_elems(this.root, '/svg:svg/g[not(@therion:role="none")]')
+    e = this.layer_scrap0
+    others = _XP_OTHER_LAYERS(this.root)
     if len(e) == 0 and others:
         this.root.remove(e)
     else:
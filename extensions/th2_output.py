@@ -11,14 +11,18 @@ from th2ex import (
     AffineType,
     EtreeElement,
     OptionsDict,
+    ParsedPath,
     th2pref,
     th2pref_load_from_xml,
+    svg_image,
     svg_polygon,
+    svg_style,
     svg_text,
     svg_textPath,
     svg_tspan,
     svg_g,
     therion_role,
+    therion_type,
     therion_options,
     xlink_href,
     inkscape_groupmode,
@@ -53,45 +57,94 @@ from inkex0 import simplestyle
 import math
 import re
 import collections
+import contextlib
+import io
+import itertools
 import os
 
 print_utf8 = print
 
+RE_CSS_CLASS = re.compile(r'\.(\w+)\s*\{(.*?)\}')
+RE_WHITESPACE = re.compile(r"\s")
 
-def parse_options_node(node: EtreeElement):
-    options = node.get(therion_options, '')
-    return parse_options(options)
+_XP_LAYERS = etree.XPath('/svg:svg/svg:g[@inkscape:groupmode="layer"]', namespaces=inkex.NSS)
+_XP_DESC = etree.XPath('svg:desc', namespaces=inkex.NSS)
+
+
+_parse_options_node_cache: Dict[str, OptionsDict] = {}
+
+
+def parse_options_node(node: EtreeElement) -> OptionsDict:
+    """
+    Parse the therion:options attribute of a layer or xvi image group.
+
+    Results are cached per attribute value (those are few and often
+    identical), the caller gets its own copy.
+    """
+    optionsstr = node.get(therion_options, '')
+    options = _parse_options_node_cache.get(optionsstr)
+    if options is None:
+        options = _parse_options_node_cache[optionsstr] = parse_options(optionsstr)
+    return {key: (list(value) if isinstance(value, list) else value)
+            for (key, value) in options.items()}
 
 
 def transformParams(mat: AffineType, params: Sequence[float]):
+    if len(params) % 2:
+        inkex.errormsg('params index skewd!!!')
+        inkex.errormsg(str(params))
+    (a, c, e), (b, d, f) = mat
+    if len(params) == 2:
+        x, y = params
+        return [a * x + c * y + e, b * x + d * y + f]
     new: List[float] = []
-    for i in range(0, len(params), 2):
-        if i + 1 == len(params):
+    append = new.append
+    it = iter(params)
+    for x, y in zip(it, it):
+        append(a * x + c * y + e)
+        append(b * x + d * y + f)
+    return new
+
+
+def transformPath(mat: AffineType, path: ParsedPath[float]) -> ParsedPath[float]:
+    """
+    Like transformParams() for every segment of a parsed path, but unpacks
+    the matrix only once.
+    """
+    (a, c, e), (b, d, f) = mat
+    new_path: ParsedPath[float] = []
+    for cmd, params in path:
+        if len(params) == 2:
+            x, y = params
+            new_path.append((cmd, [a * x + c * y + e, b * x + d * y + f]))
+            continue
+        if len(params) % 2:
             inkex.errormsg('params index skewd!!!')
             inkex.errormsg(str(params))
-            break
-        new.append(mat[0][0] * params[i] + mat[0][1] * params[i + 1] + mat[0][2])
-        new.append(mat[1][0] * params[i] + mat[1][1] * params[i + 1] + mat[1][2])
-    return new
+        new: List[float] = []
+        append = new.append
+        it = iter(params)
+        for x, y in zip(it, it):
+            append(a * x + c * y + e)
+            append(b * x + d * y + f)
+        new_path.append((cmd, new))
+    return new_path
+
+
+_NEG_RAD2DEG = -180.0 / math.pi
 
 
 def orientation(mat: AffineType) -> float:
     '''Orientation of a (0.0, 1.0) vector after rotation with "mat"'''
-    try:
-        deg = -math.degrees(math.atan2(mat[0][1], -mat[1][1]))
-    except Exception:
-        return 0.0
-    deg = deg % 360
-    deg = round(deg, 3)
-    return deg
+    deg = math.atan2(mat[0][1], -mat[1][1]) * _NEG_RAD2DEG
+    return round(deg % 360, 3)
 
 
 def fstr(x: float) -> str:
     """
     Format float with 4 digits after the period
     """
-    s = "%.4f" % x
-    return fstr_trim_zeros(s)
+    return fstr_trim_zeros(f"{x:.4f}")
 
 
 def fstr2(x: float, dbl_dig=15, max_dig=20) -> str:
@@ -113,12 +166,9 @@ def fstr_trim_zeros(s: str) -> str:
     Strip trailing zeros from a string that represents a floating point number.
     """
     assert '.' in s
-    i = len(s) - 1
-    while s[i] == '0':
-        i -= 1
-    if s[i] == '.':
-        i += 1
-    s = s[:i + 1]
+    s = s.rstrip('0')
+    if s[-1] == '.':
+        s += '0'
     return "0.0" if s == "-0.0" else s
 
 
@@ -126,7 +176,7 @@ def optquote(x: str) -> str:
     """
     Add quotes around `x` if necessary, e.g. if it contains spaces.
     """
-    if re.search(r"\s", x) is None:
+    if RE_WHITESPACE.search(x) is None:
         return x
     return f'"{x}"'
 
@@ -146,36 +196,43 @@ class Th2Line:
         self.type = type
         self.options: OptionsDict = {}
         self.points: List[str] = []
-        self._last: Sequence[str] = []
+        # first and last point, rounded like fstr()
+        self._first_xy: Tuple[float, float] = (0.0, 0.0)
+        self._last_xy: Tuple[float, float] = (0.0, 0.0)
 
     @staticmethod
-    def _format_params(params: Sequence[float]) -> List[str]:
-        return [fstr(i) for i in params]
+    def _format_params(params: Sequence[float]) -> str:
+        # like fstr(), but with a single format operation for all values
+        formatted = ("%.4f " * len(params)) % tuple(params)
+        return " ".join(map(fstr_trim_zeros, formatted.split()))
 
     def append(self, params):
-        self._last = self._format_params(params)
-        self.points.append(" ".join(self._last))
+        self._last_xy = (round(params[-2], 4), round(params[-1], 4))
+        if not self.points:
+            self._first_xy = self._last_xy
+        self.points.append(self._format_params(params))
 
     def append_point_options(self, point_options: OptionsDict):
         # point options follow points, so there must be at least one
         assert self.points
-        self.points.extend(th2ex.format_options_iter(point_options, prefix=""))
+        if point_options:
+            self.points.extend(th2ex.format_options_iter(point_options, prefix=""))
 
     def ends_with_point(self, params: Sequence[float]) -> bool:
         assert len(params) == 2
-        return self._last[-2:] == self._format_params(params)
+        x, y = params
+        return self._last_xy == (round(x, 4), round(y, 4))
 
     def close(self):
         self.options['close'] = 'on'
-        if self.points and self.points[0].split() != self._last[-2:]:
-            self._last = self.points[0].split()
+        if self.points and self._first_xy != self._last_xy:
+            self._last_xy = self._first_xy
             self.points.append(self.points[0])
 
     def output(self):
         formatted_options = format_options_leading_space(self.options)
-        print_utf8(f"line {self.type}{formatted_options}")
-        print("  " + "\n  ".join(self.points))
-        print("endline\n")
+        points = "\n  ".join(self.points)
+        print_utf8(f"line {self.type}{formatted_options}\n  {points}\nendline\n")
 
 
 class Th2Area:
@@ -202,20 +259,20 @@ class Th2Area:
         if len(self._lines) == 1:
             self._lines[0].close()
 
+        id_prefix = "%s_%s_" % (prefix, self.type.replace(':', '_'))
+
         for line in self._lines:
             if not line.options.get('id'):
-                id_prefix = "%s_%s_" % (prefix, self.type.replace(':', '_'))
-                Th2Area.count[id_prefix] += 1
-                line.options['id'] = id_prefix + str(Th2Area.count[id_prefix])
+                n = Th2Area.count[id_prefix] + 1
+                Th2Area.count[id_prefix] = n
+                line.options['id'] = id_prefix + str(n)
             ids.append(line.options['id'])
             line.output()
 
         # output area
         formatted_options = format_options_leading_space(self.options)
-        print_utf8(f"area {self.type}{formatted_options}")
-        for lineid in ids:
-            print_utf8("  " + lineid)
-        print("endarea\n")
+        lineids = "".join(f"  {lineid}\n" for lineid in ids)
+        print_utf8(f"area {self.type}{formatted_options}\n{lineids}endarea\n")
 
 
 class Th2Output(Th2Effect):
@@ -241,6 +298,8 @@ class Th2Output(Th2Effect):
         if th2pref.textonpath:
             self.textpath_dict = dict()
         self.current_scrap_id = 'none'
+        self.style_cache: Dict[EtreeElement, Dict[str, str]] = {}
+        self.style_attr_cache: Dict[str, Dict[str, str]] = {}
 
     def get_m_per_uu(self) -> float:
         """
@@ -254,18 +313,27 @@ class Th2Output(Th2Effect):
     def get_style(self, node: EtreeElement) -> Dict[str, str]:
         """
         Get the cascaded style from the style attributes. Does not consider class attributes.
+
+        The result is cached per element and must not be modified.
         """
-        style = {}
-        stack = []
-        while node is not None:
-            stack.append(node)
-            node = node.getparent()
-        for node in reversed(stack):
+        style = self.style_cache.get(node)
+        if style is None:
+            parent = node.getparent()
+            style = dict(self.get_style(parent)) if parent is not None else {}
             style.update(self.get_style_nocascade(node))
+            self.style_cache[node] = style
         return style
 
     def get_style_nocascade(self, node: EtreeElement) -> Dict[str, str]:
-        return simplestyle.parseStyle(node.get('style', ''))
+        """
+        Parse the style attribute. The result is cached per attribute value
+        (siblings often share the same style) and must not be modified.
+        """
+        value = node.get('style', '')
+        style = self.style_attr_cache.get(value)
+        if style is None:
+            style = self.style_attr_cache[value] = simplestyle.parseStyle(value)
+        return style
 
     def get_style_attr(self, node, style, key, d=''):
         d = node.get(key, d)
@@ -325,6 +393,12 @@ class Th2Output(Th2Effect):
                 f"m_per_dots: {self.get_m_per_uu()}\n")
 
     def output(self):
+        buf = io.StringIO()
+        with contextlib.redirect_stdout(buf):
+            self.output_th2()
+        self.write_output(buf.getvalue().encode('utf-8'))
+
+    def output_th2(self):
         root = self.document.getroot()
         self.doc_width_m = convert_unit(root.get('width') or '', "m")
         self.doc_height_m = convert_unit(root.get('height') or '', "m")
@@ -339,13 +413,19 @@ class Th2Output(Th2Effect):
 
         self.setdefault_doc_dims()
 
+        # collect the elements of interest in a single tree walk
+        nodes_by_tag: Dict[str, List[EtreeElement]] = {
+            tag: [] for tag in (svg_style, svg_textPath, svg_image, svg_g)
+        }
+        for node in root.iter(*nodes_by_tag):
+            nodes_by_tag[node.tag].append(node)
+
         self.classes = {}
-        stylenodes = self.document.xpath('//svg:style', namespaces=inkex.NSS)
-        pattern = re.compile(r'\.(\w+)\s*\{(.*?)\}')
+        stylenodes = nodes_by_tag[svg_style]
         for stylenode in stylenodes:
             if isinstance(stylenode.text, str):
-                for x in pattern.finditer(stylenode.text):
-                    self.classes[x.group(1)] = simplestyle.parseStyle(x.group(2).strip())
+                for name, body in RE_CSS_CLASS.findall(stylenode.text):
+                    self.classes[name] = simplestyle.parseStyle(body.strip())
 
         print('encoding  utf-8')
         if self.doc_width and self.doc_height:
@@ -364,7 +444,7 @@ class Th2Output(Th2Effect):
 
         # text on path
         if th2pref.textonpath:
-            textpaths = self.document.xpath('//svg:textPath', namespaces=inkex.NSS)
+            textpaths = nodes_by_tag[svg_textPath]
             for node in textpaths:
                 href = node.get(xlink_href).split('#', 1)[-1]
                 options = {'text': self.get_point_text(node)}
@@ -372,8 +452,11 @@ class Th2Output(Th2Effect):
                 self.textpath_dict[href] = options
 
         if self.options.images:
-            images = self.document.xpath('//svg:image', namespaces=inkex.NSS) + \
-                self.document.xpath('//svg:g[@therion:type="xth_me_image_insert"]', namespaces=inkex.NSS)
+            xvi_images = (node for node in nodes_by_tag[svg_g]
+                          if node.get(therion_type) == "xth_me_image_insert")
+            images = itertools.chain(nodes_by_tag[svg_image], xvi_images)
+            document_path = os.getenv("DOCUMENT_PATH")
+            document_dir = os.path.dirname(document_path) if document_path else ''
             # for node in reversed(images):
             for node in images:
                 params = [self.unittouu(node.get('x', '0')), self.unittouu(node.get('y', '0'))]
@@ -381,7 +464,7 @@ class Th2Output(Th2Effect):
                 href = node.get(xlink_href, '')
                 XVIroot = '{}'
                 if href == '':  # xvi image (svg:g)
-                    options = parse_options(node.get(therion_options, ''))
+                    options = parse_options_node(node)
                     href = options.get('href', '')
                     XVIroot = options.get('XVIroot', '{}')
                 elif href.startswith('data:'):
@@ -396,9 +479,8 @@ class Th2Output(Th2Effect):
                     continue
                 if href.startswith('file://'):
                     href = href[7:]
-                document_path = os.getenv("DOCUMENT_PATH")
                 if document_path:
-                    href = os.path.relpath(href, os.path.dirname(document_path))
+                    href = os.path.relpath(href, document_dir)
                 print('##XTHERION## xth_me_image_insert {%s 1 1.0} {%s %s} %s 0 {}' %
                       (fstr2(paramsTrans[0], 6), fstr2(paramsTrans[1], 6), XVIroot, optquote(href)))
 
@@ -412,7 +494,7 @@ class Th2Output(Th2Effect):
                 layer = layer.getparent()
             self.output_scrap(layer)
         else:
-            layers = self.document.xpath('/svg:svg/svg:g[@inkscape:groupmode="layer"]', namespaces=inkex.NSS)
+            layers = _XP_LAYERS(self.document)
             if len(layers) == 0:
                 inkex.errormsg("Document has no layers!\nFallback to single scrap")
                 layers = [root]
@@ -431,6 +513,13 @@ class Th2Output(Th2Effect):
         self.print_scrap_end(not self.options.lay2scr)
 
     def output_g(self, node):
+        output_role = {
+            'textblock': self.output_textblock,
+            'point': self.output_point,
+            'line': self.output_line,
+            'area': self.output_area,
+        }
+
         for child in reversed(node):
             if isinstance(child, etree._Comment):
                 if child.text.startswith('#therion'):
@@ -442,19 +531,16 @@ class Th2Output(Th2Effect):
             if role == 'none':
                 continue
 
-            if self.options.layers == 'visible':
+            # Ancestors were already checked, so only a display property in
+            # the child's own style can hide it.
+            if self.options.layers == 'visible' and 'display' in child.get('style', ''):
                 style = self.get_style(child)
                 if style.get('display') == 'none':
                     continue
 
-            if role == 'textblock':
-                self.output_textblock(child)
-            elif role == 'point':
-                self.output_point(child)
-            elif role == 'line':
-                self.output_line(child)
-            elif role == 'area':
-                self.output_area(child)
+            output = output_role.get(role)
+            if output is not None:
+                output(child)
             elif child.tag == svg_g:
                 self.output_g(child)
 
@@ -514,7 +600,7 @@ class Th2Output(Th2Effect):
 
         point_options = get_props(node)[2] if inner else {}
         mat = self.i2d_affine(node)
-        p = [(cmd, transformParams(mat, params)) for (cmd, params) in parsePath(d)]
+        p = transformPath(mat, parsePath(d))
         nodetypes = node.get(sodipodi_nodetypes, "") + "?" * len(p)
 
         for ((cmd, params), nodetype) in zip(p, nodetypes):
@@ -563,7 +649,7 @@ class Th2Output(Th2Effect):
         a = line.split()
         if a:
             print_utf8(line)
-        desc = node.xpath('svg:desc', namespaces=inkex.NSS)
+        desc = _XP_DESC(node)
         if len(desc) > 0:
             print_utf8(desc[0].text.rstrip())
         if a:
@@ -571,19 +657,22 @@ class Th2Output(Th2Effect):
         print()
 
     def get_point_text(self, node):
-        text = ''
+        parts = []
         if isinstance(node.text, str) and len(node.text.strip()) > 0:
-            text = node.text.replace('\n', ' ')
+            parts.append(node.text.replace('\n', ' '))
         for child in node:
-            if child.tag == svg_tspan or \
-                    not th2pref.textonpath and child.tag == svg_textPath:
-                if len(text) > 0 and child.get(sodipodi_role, '') == 'line':
-                    text += '<br>'
-                text += self.get_point_text(child)
+            tag = child.tag
+            if tag == svg_tspan or \
+                    tag == svg_textPath and not th2pref.textonpath:
+                if parts and child.get(sodipodi_role, '') == 'line':
+                    parts.append('<br>')
+                child_text = self.get_point_text(child)
+                if child_text:
+                    parts.append(child_text)
             if isinstance(child.tail, str) and len(child.tail.strip()) > 0:
-                text += child.tail.replace('\n', ' ')
+                parts.append(child.tail.replace('\n', ' '))
         # strip newlines between language alternatives
-        text = text.replace("<br><lang:", "<lang:")
+        text = ''.join(parts).replace("<br><lang:", "<lang:")
         return text
 
     align_rl = {
@@ -635,8 +724,7 @@ class Th2Output(Th2Effect):
                 fontsize_pt > fonts_setup_default['xl'] * 1.5):
             scale = f'{fontsize_pt / fonts_setup_default["m"]:g}'
         else:
-            scale = min(fonts_setup_default.items(),
-                        key=lambda item: abs(item[1] - fontsize_pt))[0]
+            scale = th2ex.closest_font_scale(fontsize_pt)
         if scale != 'm':
             options['scale'] = scale
 
@@ -7,12 +7,24 @@ Distributed under the terms of the GNU General Public License v2 or later
 '''
 
 import contextlib
+import functools
 import sys
 import th2ex
 import tkinter
 
 from lxml import etree
 
+# variables read from an XVI file
+_XVI_VARS = ('XVIstations', 'XVIshots', 'XVIsketchlines', 'XVIgrid')
+
+
+@functools.lru_cache(maxsize=1)
+def _get_tcl_eval():
+    """
+    Shared Tcl interpreter for all XVI files (one per process).
+    """
+    return tkinter.Tcl().tk.eval
+
 
 def xvi2svg(handle, fullsvg=True, strokewidth=6, XVIroot='',
             scale: float = 200.0):
@@ -22,7 +34,8 @@ def xvi2svg(handle, fullsvg=True, strokewidth=6, XVIroot='',
     """
     # file contents
     filecontents = ''.join(handle)
-    tk_instance = tkinter.Tcl().tk.eval
+    tk_instance = _get_tcl_eval()
+    tk_instance('unset -nocomplain ' + ' '.join(_XVI_VARS))
     tk_instance(filecontents)
 
     # methods
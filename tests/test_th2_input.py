@@ -1,5 +1,7 @@
 import th2_input as m
 import pytest
+import subprocess
+import sys
 from pytest import approx
 
 
@@ -13,8 +15,9 @@ def test_floatscale():
 
 
 def test_flipY():
-    a = [c.rstrip("0") for c in m.flipY(["1", "2", "4", "6", "8", "10"])]
-    assert a == ["0.25", "-0.5", "1.", "-1.5", "2.", "-2.5"]
+    a = m.flipY(["1", "2", "4", "6", "8", "10"])
+    assert a == ["0.25", "-0.5", "1", "-1.5", "2", "-2.5"]
+    assert m.flipY(["1", "2", "4"]) == ["0.25", "-0.5", "1"]
 
 
 def test_reverseP():
@@ -25,6 +28,7 @@ def test_reverseP():
 
 def test_text_to_styles():
     assert m.text_to_styles("foo") == {}
+    assert m.text_to_styles("foo<bf>") == {}
     assert m.text_to_styles("<bf><rm>foo<it>") == {
         "font-family": "serif",
         "font-weight": "bold",
@@ -40,3 +44,43 @@ def test_scale_to_fontsize():
     assert m.scale_to_fontsize("huge") == approx(16.726370)
     assert m.scale_to_fontsize("1") == approx(9.557926)
     assert m.scale_to_fontsize("2") == approx(19.115852)
+
+
+def test_tcl_list_split():
+    assert m._tcl_list_split('{1 1 1.0} {2 0@a.} "x y.png" 0 {}') == [
+        "1 1 1.0", "2 0@a.", "x y.png", "0", ""]
+    assert m._tcl_list_split(r'a\ b {c {d}} e') == ["a b", "c {d}", "e"]
+    assert m._tcl_list_split(r'"\a\b\f\v" \x41\u00e9 \101\770 {\n}') == [
+        "\a\b\f\v", "A\u00e9", "A?0", "\\n"]
+    assert m._tcl_list_split('a\\\n  b') == ["a b"]
+    assert m._tcl_list_split(r'\U0001F600 \UFFFFFFFF') == ["\U0001F600", "\U000FFFFF" + "FFF"]
+    with pytest.raises(ValueError):
+        m._tcl_list_split("{a")
+    # trailing backslash inside braces
+    with pytest.raises(ValueError):
+        m._tcl_list_split('a {C:\\scans\\')
+
+
+def test_line_error_line_number(tmp_path):
+    path_input = tmp_path / "bad.th2"
+    path_input.write_text("encoding  utf-8\n"
+                          "scrap s1\n"
+                          "line wall\n"
+                          "  1 2\n"
+                          "  3 4 5\n"
+                          "  6 7\n"
+                          "endline\n"
+                          "endscrap\n")
+    proc = subprocess.run([sys.executable, m.__file__, str(path_input)],
+                          capture_output=True, encoding="utf-8", check=True)
+    assert "[line 5] error: length = 3" in proc.stderr
+
+
+def test_scale_to_fontsize_basescale():
+    fontsize = m.scale_to_fontsize("m")
+    m.th2pref.set_basescale(2)
+    try:
+        assert m.scale_to_fontsize("m") != approx(fontsize)
+    finally:
+        m.th2pref.set_basescale(4)
+    assert m.scale_to_fontsize("m") == approx(fontsize)
@@ -35,6 +35,12 @@ def test_fstr_trim_zeros():
         m.fstr_trim_zeros("123")
 
 
+def test_transformParams():
+    mat = [[2.0, 0.0, 10.0], [0.0, -3.0, 20.0]]
+    assert m.transformParams(mat, [1, 2, 3, 4]) == [12.0, 14.0, 16.0, 8.0]
+    assert m.transformParams(mat, [1, 2, 3]) == [12.0, 14.0]
+
+
 TH2_LINE_SMOOTH_OFF = """
 line u:unknown
   10.0 -70.0
@@ -65,3 +71,82 @@ def test_th2_output__options():
     assert 'scrap scrap1 -author 1984 "Mäx Groß"' in th2content
     th2content = subprocess.check_output([sys.executable, m.__file__, "--options", '-author 1984 Mäx', str(path_input)], encoding="utf-8")
     assert 'scrap scrap1 -author 1984 "Mäx"' in th2content
+
+
+def test_th2_output__output_file(tmp_path):
+    path_output = tmp_path / "out.th2"
+    stdout = subprocess.check_output([
+        sys.executable, m.__file__, "--output",
+        str(path_output),
+        str(TESTS_DATA / "ink1.svg"),
+    ])
+    assert stdout == b""
+    assert path_output.read_bytes().startswith(b"encoding  utf-8\n")
+
+
+SVG_HIDDEN_CHILD = """<svg xmlns="http://www.w3.org/2000/svg"
+  xmlns:inkscape="http://www.inkscape.org/namespaces/inkscape"
+  viewBox="0 0 100 100" width="100" height="100">
+  <g inkscape:groupmode="layer" inkscape:label="s1">
+    <path d="M 1,2 L 3,4" inkscape:label="line wall" />
+    <g style="fill:red;display:none">
+      <path d="M 5,6 L 7,8" inkscape:label="line pit" />
+    </g>
+  </g>
+</svg>
+"""
+
+
+def test_th2_output__layers_visible(tmp_path):
+    path_input = tmp_path / "in.svg"
+    path_input.write_text(SVG_HIDDEN_CHILD)
+    args = [sys.executable, m.__file__, str(path_input)]
+    th2content = subprocess.check_output(args, encoding="utf-8")
+    assert "line wall" in th2content
+    assert "line pit" in th2content
+    th2content = subprocess.check_output(args + ["--layers=visible"], encoding="utf-8")
+    assert "line wall" in th2content
+    assert "line pit" not in th2content
+
+
+def test_orientation():
+    assert m.orientation([[1.0, 0.0, 5.0], [0.0, -1.0, 5.0]]) == 0.0
+    assert m.orientation([[0.0, -1.0, 0.0], [-1.0, 0.0, 0.0]]) == 90.0
+    assert m.orientation([[-1.0, 0.0, 0.0], [0.0, 1.0, 0.0]]) == 180.0
+    assert m.orientation([[0.0, 2.0, 0.0], [2.0, 0.0, 0.0]]) == 270.0
+
+
+def test_Th2Line():
+    line = m.Th2Line()
+    line.append([1.0, 2.0])
+    line.append([3.0, 4.0, 5.0, 6.0, 7.00001, -0.00004])
+    assert line.ends_with_point([7.0, 0.0])
+    assert not line.ends_with_point([7.0, 0.0001])
+    line.close()
+    assert line.points == ["1.0 2.0", "3.0 4.0 5.0 6.0 7.0 0.0", "1.0 2.0"]
+    assert line.ends_with_point([1.0, 2.0])
+
+
+def test_get_point_text():
+    from lxml import etree
+    node = etree.fromstring(
+        '<text xmlns="http://www.w3.org/2000/svg"'
+        ' xmlns:sodipodi="http://sodipodi.sourceforge.net/DTD/sodipodi-0.dtd">'
+        '<tspan sodipodi:role="line">one</tspan>'
+        '<tspan sodipodi:role="line"></tspan>'
+        '<tspan sodipodi:role="line">two <tspan>three</tspan></tspan>'
+        '<tspan sodipodi:role="line">&lt;lang:en&gt;four</tspan>'
+        '</text>')
+    text = m.Th2Output().get_point_text(node)
+    assert text == "one<br><br>two three<lang:en>four"
+
+
+def test_parse_options_node():
+    from lxml import etree
+    node = etree.Element("g", {m.therion_options: "-author 2001 Max -scale [1 2 m]"})
+    first = m.parse_options_node(node)
+    assert first == {"author": [("2001", "Max")], "scale": "[1 2 m]"}
+    # cached results are not shared between callers
+    first["author"].append(("2002", "Jane"))
+    first["close"] = "on"
+    assert m.parse_options_node(node) == {"author": [("2001", "Max")], "scale": "[1 2 m]"}
@@ -163,3 +163,24 @@ def test_get_fonts_setup_default():
     assert m.get_fonts_setup_default(200) == m.fonts_setup_defaults[200]
     assert m.get_fonts_setup_default(250) == m.fonts_setup_defaults[500]
     assert m.get_fonts_setup_default(999) == m.fonts_setup_defaults[float("inf")]
+
+
+def test_closest_font_scale():
+    assert m.closest_font_scale(1, 100) == "xs"
+    assert m.closest_font_scale(9, 100) == "xs"
+    assert m.closest_font_scale(9.1, 100) == "s"
+    assert m.closest_font_scale(12, 100) == "m"
+    assert m.closest_font_scale(20.1, 100) == "xl"
+    assert m.closest_font_scale(99, 100) == "xl"
+    assert m.closest_font_scale(10, 999) == "xl"
+
+
+def test_getElementById():
+    from lxml import etree
+    effect = m.Th2Effect()
+    effect.document = etree.ElementTree(etree.fromstring(
+        '<svg xmlns="http://www.w3.org/2000/svg">'
+        '<g id="a"><path id="b" /><path id="it\'s" /></g></svg>'))
+    assert effect.getElementById("b").get("id") == "b"
+    assert effect.getElementById("it's") is not None
+    assert effect.getElementById("c") is None
@@ -45,3 +45,12 @@ def test_xvi2svg():
     assert root[0].get("{http://www.inkscape.org/namespaces/inkscape}label") == "Shots"
     assert root[0][0].tag == "{http://www.w3.org/2000/svg}path"
     assert root[0][0].get("d") == "M 197.83 179.72 174.41 103.15"
+
+
+def test_xvi2svg_no_leftovers():
+    with open(TESTS_DATA / "create.xvi") as handle:
+        xvi_input.xvi2svg(handle, fullsvg=False)
+    content = "set XVIgrid {0.0 0.0 1.0 0.0 0.0 1.0 2 2}\n"
+    root = xvi_input.xvi2svg([content], fullsvg=False)
+    assert root[0].get("{http://www.inkscape.org/namespaces/inkscape}label") == "Shots"
+    assert len(root[0]) == 0